@@ -3,11 +3,14 @@
 import streamlit as st
 import firebase_admin
 from firebase_admin import credentials, firestore
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from dateutil.relativedelta import relativedelta
 import calendar
+import functools
+import types
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
-import uuid
 
 # --- ページ設定 ---
 st.set_page_config(
@@ -40,11 +43,22 @@ if not db:
     st.stop()
 
 # --- Firestoreコレクションへの参照 ---
-EVENTS_COLLECTION = "shift_calendar/data/events"
+MONTHS_COLLECTION = "shift_calendar/data/months"  # シフトは months/{month_id}/events に月ごとに保存
+LEGACY_EVENTS_COLLECTION = "shift_calendar/data/events"  # 月別に分ける前のシフト保存先（移行元）
 DAY_STATUS_COLLECTION = "shift_calendar/data/day_status"
 MONTH_LOCKS_COLLECTION = "shift_calendar/data/month_locks"
 BOARD_COLLECTION = "shift_calendar/data/bulletin_board"
+META_COLLECTION = "shift_calendar/data/meta"
 MAX_SHIFTS_PER_DAY = 3
+BATCH_WRITE_LIMIT = 450  # Firestoreのバッチ上限(500件)より少し余裕を持たせる
+CLEANUP_INTERVAL = timedelta(hours=1)
+IN_QUERY_LIMIT = 30  # Firestoreの'in'フィルタに渡せる値の上限
+# 曜日ごとの表示名と文字色（calendar.monthcalendarと同じ月曜始まり）
+WEEKDAY_HTML = [("月", "inherit"), ("火", "inherit"), ("水", "inherit"), ("木", "inherit"), ("金", "inherit"), ("土", "blue"), ("日", "red")]
+
+def month_events_collection(month_id):
+    """指定された月のシフトを格納するサブコレクションへの参照を返す"""
+    return db.collection(f"{MONTHS_COLLECTION}/{month_id}/events")
 
 # --- セッション状態の初期化 ---
 if 'current_date' not in st.session_state:
@@ -53,46 +67,275 @@ if 'admin_mode' not in st.session_state:
     st.session_state.admin_mode = False
 if 'user_name' not in st.session_state:
     st.session_state.user_name = ""
+# 1回の実行内で同じ月のデータを使い回すためのメモ。アプリ全体の実行ごとに作り直す。
+# フラグメント単体の再実行ではここが走らないため、run_tokenで見分けて各フラグメントが自分の月の分を破棄する
+st.session_state.month_memo = {}
+st.session_state.run_token = object()
+if 'prefetch' not in st.session_state:
+    st.session_state.prefetch = {}
 
 # --- データ取得・クリーンアップ関数 ---
 @st.cache_data(ttl=60)
-def get_firestore_data(year, month):
+def get_month_version(year, month):
+    """月のデータ更新回数（meta/{month_id}.version）を取得する"""
+    month_id = f"{year}-{month:02d}"
+    meta_doc = db.collection(META_COLLECTION).document(month_id).get()
+    return meta_doc.to_dict().get('version', 0) if meta_doc.exists else 0
+
+def forget_month_cache(year, month):
+    """月のversionキャッシュ（プロセス内の全セッションで共有）と、このセッションのメモを破棄する"""
+    get_month_version.clear(year, month)
+    st.session_state.month_memo.pop((year, month), None)
+
+def touch_month(year, month, batch=None):
+    """月のデータが更新されたことを記録し、キャッシュを無効化する。
+    batchを渡した場合は、データの書き込みとversionの更新を1回のコミットで行う"""
+    month_id = f"{year}-{month:02d}"
+    if batch is None:
+        batch = db.batch()
+    batch.set(db.collection(META_COLLECTION).document(month_id), {'version': firestore.Increment(1)}, merge=True)
+    batch.commit()
+    forget_month_cache(year, month)
+
+def set_month_lock(year, month, is_locked):
+    """月をロック/ロック解除する"""
+    batch = db.batch()
+    batch.set(db.collection(MONTH_LOCKS_COLLECTION).document(f"{year}-{month:02d}"), {'isLocked': is_locked})
+    touch_month(year, month, batch)
+
+@firestore.transactional
+def _add_shift_if_open(transaction, month_id, date_str, name):
+    """同じ日に未登録かつ空きがある場合だけシフトを追加する"""
+    events_ref = month_events_collection(month_id)
+    query = events_ref.where(filter=firestore.FieldFilter('date', '==', date_str))
+    day_docs = list(query.get(transaction=transaction))
+    if any(doc.get('name') == name for doc in day_docs):
+        return "duplicate"
+    if len(day_docs) >= MAX_SHIFTS_PER_DAY:
+        return "full"
+    transaction.set(events_ref.document(), {
+        'date': date_str, 'month_id': month_id,
+        'name': name,
+        'createdAt': firestore.SERVER_TIMESTAMP
+    })
+    transaction.set(db.collection(META_COLLECTION).document(month_id), {'version': firestore.Increment(1)}, merge=True)
+    return "added"
+
+def add_shift(year, month, date_str, name):
+    """シフトを追加する。同時に押されても重複・定員超過しないようトランザクションで判定する"""
+    result = _add_shift_if_open(db.transaction(), f"{year}-{month:02d}", date_str, name)
+    # 追加できなかった場合も、表示中のデータが古い可能性があるので破棄する
+    forget_month_cache(year, month)
+    return result
+
+def refresh_month_on_fragment_rerun(fragment_name, year, month):
+    """フラグメント単体の再実行時だけ月のメモを破棄し、versionを確認し直させる"""
+    seen_key = f"{fragment_name}_run_token"
+    if st.session_state.get(seen_key) is st.session_state.run_token:
+        st.session_state.month_memo.pop((year, month), None)
+    st.session_state[seen_key] = st.session_state.run_token
+
+def load_month_data(year, month):
+    """月のデータを取得する。versionが変わった時だけFirestoreへ問い合わせる"""
+    memo = st.session_state.month_memo
+    if (year, month) not in memo:
+        version = get_month_version(year, month)
+        data = None
+        prefetched = st.session_state.prefetch.pop((year, month), None)
+        # まだ始まっていない先読みは取り消す。実行中で同じversionなら、二重に問い合わせず結果を待つ
+        if prefetched and not prefetched['future'].cancel() and prefetched['version'] == version:
+            try:
+                data = prefetched['future'].result()
+            except Exception:
+                data = None
+        if data is None:
+            data = get_firestore_data(year, month, version)
+        memo[(year, month)] = data
+    return memo[(year, month)]
+
+@st.cache_resource
+def get_prefetch_executor():
+    """前後の月の先読みに使うスレッドプールを返す"""
+    return ThreadPoolExecutor(max_workers=2)
+
+def prefetch_adjacent_months(year, month):
+    """前後の月のデータをバックグラウンドで共有キャッシュに読み込んでおく"""
+    current = datetime(year, month, 1)
+    neighbors = [current - relativedelta(months=1), current + relativedelta(months=1)]
+    neighbor_keys = {(d.year, d.month) for d in neighbors}
+    # 前後の月以外の先読みは不要なので、取り消してセッションから取り除く
+    for key in list(st.session_state.prefetch):
+        if key not in neighbor_keys:
+            st.session_state.prefetch.pop(key)['future'].cancel()
+    for neighbor in neighbors:
+        key = (neighbor.year, neighbor.month)
+        version = get_month_version(*key)
+        prefetched = st.session_state.prefetch.get(key)
+        if prefetched and prefetched['version'] == version:
+            continue
+        if prefetched:
+            prefetched['future'].cancel()
+        # get_firestore_data経由なので、キャッシュ済みの月は問い合わせず、結果は全セッションで共有される
+        st.session_state.prefetch[key] = {
+            'version': version,
+            'future': get_prefetch_executor().submit(get_firestore_data, *key, version),
+        }
+
+@st.cache_data(max_entries=64, ttl=3600, show_spinner=False)  # コンソールなどアプリ外での変更も1時間以内には反映させる
+def get_firestore_data(year, month, version):
+    """指定された月のFirestoreデータを取得する（versionはキャッシュキーとしてのみ使用）"""
+    return fetch_month_data(year, month)
+
+def fetch_month_data(year, month):
     """指定された月のFirestoreデータを取得する"""
     month_id = f"{year}-{month:02d}"
-    
-    events_ref = db.collection(EVENTS_COLLECTION)
-    query = events_ref.where('month_id', '==', month_id)
-    events = {doc.id: doc.to_dict() for doc in query.stream()}
-    
-    day_status_ref = db.collection(DAY_STATUS_COLLECTION)
-    query = day_status_ref.where('month_id', '==', month_id)
-    day_status = {doc.id: doc.to_dict() for doc in query.stream()}
-    
-    month_lock_doc = db.collection(MONTH_LOCKS_COLLECTION).document(month_id).get()
-    is_month_locked = month_lock_doc.exists and month_lock_doc.to_dict().get('isLocked', False)
 
-    board_ref = db.collection(BOARD_COLLECTION)
-    query = board_ref.where('month_id', '==', month_id).order_by('timestamp', direction=firestore.Query.DESCENDING)
-    board_messages = [doc.to_dict() for doc in query.stream()]
+    def fetch_events():
+        # カレンダー表示に必要な項目だけを取得し、項目ごとの配列にまとめる
+        query = month_events_collection(month_id).select(['name', 'date'])
+        events = {'doc_ids': [], 'names': [], 'dates': []}
+        for doc in query.stream():
+            data = doc.to_dict()
+            events['doc_ids'].append(doc.id)
+            events['names'].append(data.get('name'))
+            events['dates'].append(data.get('date'))
+        return events
+
+    def fetch_day_status():
+        query = db.collection(DAY_STATUS_COLLECTION).where(filter=firestore.FieldFilter('month_id', '==', month_id))
+        return {doc.id: doc.to_dict() for doc in query.stream()}
+
+    def fetch_month_lock():
+        month_lock_doc = db.collection(MONTH_LOCKS_COLLECTION).document(month_id).get()
+        return month_lock_doc.exists and month_lock_doc.to_dict().get('isLocked', False)
+
+    def fetch_board_messages():
+        query = db.collection(BOARD_COLLECTION).where(filter=firestore.FieldFilter('month_id', '==', month_id)).order_by('timestamp', direction=firestore.Query.DESCENDING)
+        return [doc.to_dict() for doc in query.stream()]
+
+    # 4つのクエリを並列に発行し、待ち時間を最も遅いクエリ1回分に抑える
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        events_future = executor.submit(fetch_events)
+        day_status_future = executor.submit(fetch_day_status)
+        month_lock_future = executor.submit(fetch_month_lock)
+        board_future = executor.submit(fetch_board_messages)
+        events = events_future.result()
+        day_status = day_status_future.result()
+        is_month_locked = month_lock_future.result()
+        board_messages = board_future.result()
 
     return events, day_status, is_month_locked, board_messages
 
+@st.cache_resource
+def migrate_legacy_events():
+    """旧コレクションのシフトを月別サブコレクションへ同じドキュメントIDでコピーする（プロセスごとに1回だけ確認）"""
+    meta_ref = db.collection(META_COLLECTION).document('events_migration')
+    meta_doc = meta_ref.get()
+    if meta_doc.exists and meta_doc.to_dict().get('done', False):
+        return
+
+    # 上限件数ごとにページングしてコピーする。同じIDへのsetなので途中で失敗しても再実行できる
+    query = (db.collection(LEGACY_EVENTS_COLLECTION)
+             .order_by(firestore.FieldPath.document_id())
+             .limit(BATCH_WRITE_LIMIT))
+    touched_months = set()
+    copied_count = 0
+    skipped_doc_ids = []  # month_idもdateもなく移行先を決められなかったドキュメント
+    last_doc = None
+    while True:
+        page = query.start_after(last_doc) if last_doc else query
+        docs = list(page.stream())
+        if not docs:
+            break
+        batch = db.batch()
+        for doc in docs:
+            data = doc.to_dict()
+            month_id = data.get('month_id') or (data.get('date') or '')[:7]
+            if not month_id:
+                skipped_doc_ids.append(doc.id)
+                continue
+            batch.set(month_events_collection(month_id).document(doc.id), data)
+            touched_months.add(month_id)
+            copied_count += 1
+        batch.commit()
+        if len(docs) < BATCH_WRITE_LIMIT:
+            break
+        last_doc = docs[-1]
+
+    # コピーした月のキャッシュを他の利用者の分も含めて更新させる
+    for month_id in touched_months:
+        db.collection(META_COLLECTION).document(month_id).set({'version': firestore.Increment(1)}, merge=True)
+    get_month_version.clear()
+    meta_ref.set({
+        'done': True, 'copied_count': copied_count,
+        'skipped_count': len(skipped_doc_ids), 'skipped_doc_ids': skipped_doc_ids[:100],
+        'migrated_at': firestore.SERVER_TIMESTAMP
+    })
+
+@firestore.transactional
+def _claim_cleanup(transaction, meta_ref, now):
+    """前回のクリーンアップから一定時間経過していれば実行権を取得する"""
+    snapshot = meta_ref.get(transaction=transaction)
+    last_cleanup_at = snapshot.get('last_cleanup_at') if snapshot.exists else None
+    if last_cleanup_at and now - last_cleanup_at < CLEANUP_INTERVAL:
+        return False
+    transaction.set(meta_ref, {'last_cleanup_at': now}, merge=True)
+    return True
+
 def cleanup_old_board_messages():
     """投稿から2週間以上経過した掲示板メッセージを削除する"""
-    two_weeks_ago = datetime.now() - timedelta(weeks=2)
-    old_messages_query = db.collection(BOARD_COLLECTION).where('timestamp', '<', two_weeks_ago).stream()
-    
-    batch = db.batch()
-    deleted_count = 0
-    for doc in old_messages_query:
-        batch.delete(doc.reference)
-        deleted_count += 1
-    
-    if deleted_count > 0:
+    meta_ref = db.collection(META_COLLECTION).document('board_cleanup')
+    if not _claim_cleanup(db.transaction(), meta_ref, datetime.now(timezone.utc)):
+        return
+
+    two_weeks_ago = datetime.now(timezone.utc) - timedelta(weeks=2)
+    # 本文は不要なのでmonth_idのみ取得し、上限件数ごとに分割して削除する
+    query = (db.collection(BOARD_COLLECTION)
+             .where(filter=firestore.FieldFilter('timestamp', '<', two_weeks_ago))
+             .select(['month_id'])
+             .limit(BATCH_WRITE_LIMIT))
+    touched_months = set()
+    while True:
+        docs = list(query.stream())
+        if not docs:
+            break
+        batch = db.batch()
+        for doc in docs:
+            batch.delete(doc.reference)
+            touched_months.add(doc.get('month_id'))
         batch.commit()
+        if len(docs) < BATCH_WRITE_LIMIT:
+            break
+
+    for month_id in touched_months:
+        if month_id:
+            year, month = map(int, month_id.split('-'))
+            touch_month(year, month)
 
 # --- UIコンポーネントとロジック ---
 
+@functools.lru_cache(maxsize=64)
+def get_month_weeks(year, month):
+    """月のカレンダー（週ごとの日付）を返す。共有されるためタプルで返す"""
+    return tuple(tuple(week) for week in calendar.monthcalendar(year, month))
+
+@functools.lru_cache(maxsize=64)
+def get_month_labels(year, month):
+    """日付文字列（日→YYYY-MM-DD）と日付見出しHTML（(日, 曜日)→HTML）を月ごとにまとめて作る。
+    共有されるためタプルと読み取り専用の辞書で返す"""
+    month_prefix = f"{year}-{month:02d}-"
+    date_strs = [f"{month_prefix}{d:02d}" if d else "" for d in range(32)]
+    header_html = {}
+    for week in get_month_weeks(year, month):
+        for i, day in enumerate(week):
+            if day:
+                day_name, color = WEEKDAY_HTML[i]
+                header_html[(day, i)] = "".join([
+                    "<p style='color:", color, "; margin-bottom:0; text-align:center;'><strong>",
+                    str(day), "</strong> (", day_name, ")</p>"
+                ])
+    return tuple(date_strs), types.MappingProxyType(header_html)
+
 def show_welcome_and_name_input():
     """ウェルカムメッセージと名前入力フォームを表示する"""
     st.subheader("ようこそ！シフト管理を始めるには、まずお名前を教えてください。")
@@ -125,14 +368,20 @@ def show_main_app():
     show_calendar()
     show_board_and_info()
 
+    year = st.session_state.current_date.year
+    month = st.session_state.current_date.month
+    prefetch_adjacent_months(year, month)
+
 
+@st.fragment
 def show_calendar():
-    """カレンダーのメインUIを描画する"""
+    """カレンダーのメインUIを描画する（シフト操作ではこの部分だけを再実行する）"""
     year = st.session_state.current_date.year
     month = st.session_state.current_date.month
     month_id = f"{year}-{month:02d}"
 
-    events, day_status, is_month_locked, _ = get_firestore_data(year, month)
+    refresh_month_on_fragment_rerun("calendar", year, month)
+    events, day_status, is_month_locked, _ = load_month_data(year, month)
 
     header_cols = st.columns([1, 2, 1])
     if header_cols[0].button("<< 前の月"):
@@ -143,11 +392,25 @@ def show_calendar():
         st.session_state.current_date += relativedelta(months=1)
         st.rerun()
 
+    # 再実行前に記録したシフト追加の結果を表示する
+    if 'shift_notice' in st.session_state:
+        st.warning(st.session_state.pop('shift_notice'))
+
     if is_month_locked:
         st.error("🔒 この月はロックされているため、シフトの編集や掲示板への書き込みはできません。")
 
-    cal = calendar.monthcalendar(year, month)
-    days_of_week = ["月", "火", "水", "木", "金", "土", "日"]
+    # 開催日もシフトもない月は、管理者以外にはカレンダー枠を描画しない
+    if not events['doc_ids'] and not day_status and not st.session_state.admin_mode:
+        st.info("この月はまだ開催日が登録されていません。")
+        return
+
+    cal = get_month_weeks(year, month)
+    date_strs, header_html = get_month_labels(year, month)
+
+    # 日付ごとのシフトを一度だけ振り分けておく
+    events_by_date = {}
+    for date, name, doc_id in zip(events['dates'], events['names'], events['doc_ids']):
+        events_by_date.setdefault(date, []).append((doc_id, name))
     
     st.divider()
 
@@ -158,36 +421,35 @@ def show_calendar():
                 cols[i].write("")
                 continue
             
-            day_name = days_of_week[i]
-            date_str = f"{month_id}-{day:02d}"
+            date_str = date_strs[day]
             is_held = day_status.get(date_str, {}).get('isHeld', False)
             
             with cols[i].container(border=True):
-                color = "red" if day_name == "日" else "blue" if day_name == "土" else "inherit"
-                st.markdown(f"<p style='color:{color}; margin-bottom:0; text-align:center;'><strong>{day}</strong> ({day_name})</p>", unsafe_allow_html=True)
+                st.markdown(header_html[(day, i)], unsafe_allow_html=True)
 
                 if st.session_state.admin_mode:
                     new_is_held = st.checkbox("開催", value=is_held, key=f"held_{date_str}", disabled=is_month_locked)
                     if new_is_held != is_held:
-                        db.collection(DAY_STATUS_COLLECTION).document(date_str).set({'isHeld': new_is_held, 'month_id': month_id})
-                        st.cache_data.clear(); st.rerun()
+                        batch = db.batch()
+                        batch.set(db.collection(DAY_STATUS_COLLECTION).document(date_str), {'isHeld': new_is_held, 'month_id': month_id})
+                        touch_month(year, month, batch); st.rerun(scope="fragment")
                 elif is_held:
                     st.success("開催日")
 
-                day_events = [data for data in events.values() if data.get('date') == date_str]
-                for event in day_events:
-                    doc_id = [k for k, v in events.items() if v == event][0]
+                day_events = events_by_date.get(date_str, [])
+                for doc_id, name in day_events:
                     shift_cols = st.columns([3, 1])
-                    if event.get('name') == st.session_state.user_name:
-                        shift_cols[0].info(f"👤 {event.get('name')}")
+                    if name == st.session_state.user_name:
+                        shift_cols[0].info(f"👤 {name}")
                     else:
-                        shift_cols[0].write(f"👤 {event.get('name')}")
+                        shift_cols[0].write(f"👤 {name}")
                     
                     # 【修正点1】管理者なら自分以外のシフトも削除可能に
-                    if (event.get('name') == st.session_state.user_name or st.session_state.admin_mode) and not is_month_locked:
+                    if (name == st.session_state.user_name or st.session_state.admin_mode) and not is_month_locked:
                         if shift_cols[1].button("✖️", key=f"del_{doc_id}", help="シフトを削除"):
-                            db.collection(EVENTS_COLLECTION).document(doc_id).delete()
-                            st.cache_data.clear(); st.rerun()
+                            batch = db.batch()
+                            batch.delete(month_events_collection(month_id).document(doc_id))
+                            touch_month(year, month, batch); st.rerun(scope="fragment")
                 
                 if is_held and not is_month_locked:
                     if len(day_events) < MAX_SHIFTS_PER_DAY:
@@ -200,35 +462,31 @@ def show_calendar():
                                         new_event = {
                                             'date': date_str, 'month_id': month_id,
                                             'name': admin_add_name,
-                                            'createdAt': firestore.SERVER_TIMESTAMP,
-                                            'uid': str(uuid.uuid4())
+                                            'createdAt': firestore.SERVER_TIMESTAMP
                                         }
-                                        db.collection(EVENTS_COLLECTION).add(new_event)
-                                        st.cache_data.clear(); st.rerun()
+                                        batch = db.batch()
+                                        batch.set(month_events_collection(month_id).document(), new_event)
+                                        touch_month(year, month, batch); st.rerun(scope="fragment")
                         # 通常ユーザーの場合はこれまで通りのボタンを表示
                         else:
                             if st.button("シフトに入る", key=f"add_{date_str}"):
-                                is_already_in = any(e['name'] == st.session_state.user_name for e in day_events)
-                                if not is_already_in:
-                                    new_event = {
-                                        'date': date_str, 'month_id': month_id,
-                                        'name': st.session_state.user_name,
-                                        'createdAt': firestore.SERVER_TIMESTAMP,
-                                        'uid': str(uuid.uuid4())
-                                    }
-                                    db.collection(EVENTS_COLLECTION).add(new_event)
-                                    st.cache_data.clear(); st.rerun()
-                                else:
-                                    st.warning("すでに入っています。")
+                                result = add_shift(year, month, date_str, st.session_state.user_name)
+                                if result == "duplicate":
+                                    st.session_state.shift_notice = "すでに入っています。"
+                                elif result == "full":
+                                    st.session_state.shift_notice = f"{date_str} は満員になりました。"
+                                st.rerun(scope="fragment")
                     else:
                         st.warning("満員です")
 
+@st.fragment
 def show_board_and_info():
-    """掲示板と説明セクションを表示する"""
+    """掲示板と説明セクションを表示する（書き込み時はこの部分だけを再実行する）"""
     year = st.session_state.current_date.year
     month = st.session_state.current_date.month
     month_id = f"{year}-{month:02d}"
-    _, _, is_month_locked, board_messages = get_firestore_data(year, month)
+    refresh_month_on_fragment_rerun("board", year, month)
+    _, _, is_month_locked, board_messages = load_month_data(year, month)
 
     st.divider()
     col1, col2 = st.columns(2)
@@ -246,20 +504,25 @@ def show_board_and_info():
                         'month_id': month_id, 'name': name_input,
                         'message': message_input, 'timestamp': firestore.SERVER_TIMESTAMP
                     }
-                    db.collection(BOARD_COLLECTION).add(new_message)
-                    st.cache_data.clear(); st.rerun()
+                    batch = db.batch()
+                    batch.set(db.collection(BOARD_COLLECTION).document(), new_message)
+                    touch_month(year, month, batch); st.rerun(scope="fragment")
                 else:
                     st.warning("お名前とメッセージを入力してください。")
         
+        message_html = []
         for msg in board_messages:
             ts = msg.get('timestamp')
             timestamp_str = ts.strftime('%Y-%m-%d %H:%M') if ts and hasattr(ts, 'strftime') else "時刻不明"
-            st.markdown(f"""
+            message_html.append(f"""
             <div style="border-bottom: 1px solid #e0e0e0; padding-bottom: 8px; margin-bottom: 8px;">
                 <p style="margin: 0;"><strong>{msg.get('name')}</strong> <small>({timestamp_str})</small></p>
                 <p style="margin: 0; white-space: pre-wrap;">{msg.get('message')}</p>
             </div>
-            """, unsafe_allow_html=True)
+            """)
+        # メッセージ数に関わらず1回の描画で送る
+        if message_html:
+            st.markdown("".join(message_html), unsafe_allow_html=True)
 
     with col2:
         st.subheader("💡 ご利用上のルール")
@@ -292,17 +555,14 @@ def show_admin_sidebar():
 
             year = st.session_state.current_date.year
             month = st.session_state.current_date.month
-            month_id = f"{year}-{month:02d}"
-            _, _, is_month_locked, _ = get_firestore_data(year, month)
+            _, _, is_month_locked, _ = load_month_data(year, month)
             st.subheader("月のロック管理")
             if is_month_locked:
                 if st.button(f"{month}月をロック解除"):
-                    db.collection(MONTH_LOCKS_COLLECTION).document(month_id).set({'isLocked': False})
-                    st.cache_data.clear(); st.rerun()
+                    set_month_lock(year, month, False); st.rerun()
             else:
                 if st.button(f"🔴 {month}月をロックする"):
-                    db.collection(MONTH_LOCKS_COLLECTION).document(month_id).set({'isLocked': True})
-                    st.cache_data.clear(); st.rerun()
+                    set_month_lock(year, month, True); st.rerun()
 
             st.divider()
 
@@ -313,25 +573,60 @@ def show_admin_sidebar():
                 if st.button("集計する"):
                     perform_aggregation(start_date, end_date)
 
+def month_ids_between(start_date, end_date):
+    """期間に含まれる月ID(YYYY-MM)のリストを返す"""
+    month_ids = []
+    current = start_date.replace(day=1)
+    while current <= end_date:
+        month_ids.append(current.strftime('%Y-%m'))
+        current += relativedelta(months=1)
+    return month_ids
+
+def fetch_month_events_for_aggregation(month_id, dates):
+    """集計用に1か月分のシフトのうち、指定した日付のものだけを取得する"""
+    query = (month_events_collection(month_id)
+             .where(filter=firestore.FieldFilter('date', 'in', dates))
+             .select(['name', 'date']))
+    return [doc.to_dict() for doc in query.stream()]
+
+def fetch_day_status_for_aggregation(first_month_id, last_month_id):
+    """month_idの範囲クエリで集計対象期間の開催状況を取得する"""
+    query = (db.collection(DAY_STATUS_COLLECTION)
+             .where(filter=firestore.FieldFilter('month_id', '>=', first_month_id))
+             .where(filter=firestore.FieldFilter('month_id', '<=', last_month_id)))
+    return {doc.id: doc.to_dict() for doc in query.stream()}
+
 def perform_aggregation(start_date, end_date):
     """シフト集計を実行し、結果を表示・ダウンロード可能にする"""
     with st.spinner("集計中..."):
-        all_events = [doc.to_dict() for doc in db.collection(EVENTS_COLLECTION).stream()]
-        all_day_status = {doc.id: doc.to_dict() for doc in db.collection(DAY_STATUS_COLLECTION).stream()}
-        
-        filtered_events = [
-            event for event in all_events
-            if start_date <= datetime.strptime(event['date'], '%Y-%m-%d').date() <= end_date
-            and all_day_status.get(event['date'], {}).get('isHeld', False)
-        ]
-        
-        if not filtered_events:
+        month_ids = month_ids_between(start_date, end_date)
+        if not month_ids:
             st.warning("指定期間に該当する開催日のシフトデータがありません。"); return
-            
-        df = pd.DataFrame(filtered_events)
-        df['month'] = pd.to_datetime(df['date']).dt.to_period('M')
-        
-        pivot = df.pivot_table(index='name', columns='month', values='uid', aggfunc='count', fill_value=0)
+
+        all_day_status = fetch_day_status_for_aggregation(month_ids[0], month_ids[-1])
+
+        # 期間内の開催日だけを月ごとにまとめ、サーバー側で絞り込んで取得する
+        start_str, end_str = start_date.isoformat(), end_date.isoformat()
+        held_dates_by_month = defaultdict(list)
+        for date_str, status in all_day_status.items():
+            if status.get('isHeld', False) and start_str <= date_str <= end_str:
+                held_dates_by_month[status['month_id']].append(date_str)
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            events_futures = [
+                executor.submit(fetch_month_events_for_aggregation, mid, dates[i:i + IN_QUERY_LIMIT])
+                for mid, dates in held_dates_by_month.items()
+                for i in range(0, len(dates), IN_QUERY_LIMIT)
+            ]
+            all_events = [event for future in events_futures for event in future.result()]
+
+        if not all_events:
+            st.warning("指定期間に該当する開催日のシフトデータがありません。"); return
+
+        df = pd.DataFrame(all_events)
+        df['month'] = pd.to_datetime(df['date'], format='%Y-%m-%d', cache=True).dt.to_period('M')
+
+        pivot = df.pivot_table(index='name', columns='month', values='date', aggfunc='count', fill_value=0)
         pivot['合計'] = pivot.sum(axis=1)
         
         st.subheader("シフト回数集計結果")
@@ -347,7 +642,8 @@ def perform_aggregation(start_date, end_date):
 if __name__ == "__main__":
     st.title("🗓️ 見守りシフト管理カレンダー")
     st.caption("管理者の方は、画面左上の「>」をクリックしてメニューを開いてください。")
-    
+
+    migrate_legacy_events()
     show_admin_sidebar()
 
     if 'cleanup_done' not in st.session_state: